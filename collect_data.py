@@ -5,13 +5,10 @@ Run this script to collect stock data from Polygon API
 """
 
 import sys
-import os
 from pathlib import Path
 
 def main():
-    # Ensure we're in the project directory
     project_root = Path(__file__).parent
-    os.chdir(project_root)
     
     # Add project root to Python path for imports
     if str(project_root) not in sys.path:
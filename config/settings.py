@@ -1,4 +1,5 @@
 import os
+from pathlib import Path
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -6,9 +7,16 @@ load_dotenv()
 # API Configuration
 POLYGON_API_KEY = os.getenv('POLYGON_API_KEY', 'your_api_key_here')
 POLYGON_BASE_URL = 'https://api.polygon.io'
+POLYGON_RATE_LIMIT_CALLS = 5  # Free tier: 5 calls per minute
+POLYGON_RATE_LIMIT_PERIOD = 60  # Seconds
+POLYGON_MAX_CONCURRENT_REQUESTS = 5  # Requests allowed in flight at once
+POLYGON_REQUEST_TIMEOUT = 10  # Seconds per request
+POLYGON_MAX_RETRIES = 3  # Retries for transient errors (429/5xx, dropped connections)
+POLYGON_RETRY_BACKOFF = 0.3  # Seconds; doubles after each retry
 
 # Database Configuration
-DATABASE_PATH = 'data/stocks.db'
+# Absolute so the database resolves the same regardless of the working directory
+DATABASE_PATH = str(Path(__file__).resolve().parent.parent / 'data' / 'stocks.db')
 
 # Stock Watchlist (S&P 500 subset for MVP)
 WATCHLIST = [
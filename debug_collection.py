@@ -3,6 +3,7 @@
 Debug script to check data collection process
 """
 
+import asyncio
 import sys
 import os
 from pathlib import Path
@@ -23,11 +24,19 @@ def debug_single_collection():
     test_symbols = WATCHLIST[:3]
     print(f"Testing collection for: {test_symbols}")
     
-    for symbol in test_symbols:
+    async def fetch_all():
+        try:
+            return await asyncio.gather(
+                *(collector.fetch_daily_data(symbol, days=50) for symbol in test_symbols)
+            )
+        finally:
+            await collector.close()
+    
+    stored_symbols = []
+    for symbol, df in zip(test_symbols, asyncio.run(fetch_all())):
         print(f"\n--- Collecting {symbol} ---")
         
         # Test API call first
-        df = collector.fetch_daily_data(symbol, days=50)
         if df is None or df.empty:
             print(f"❌ No data fetched from API for {symbol}")
             continue
@@ -45,19 +54,20 @@ def debug_single_collection():
         # Test database insertion
         try:
             collector.db.insert_stock_data(df_with_indicators)
-            collector.db.update_last_fetch_time(symbol)
+            stored_symbols.append(symbol)
             print(f"✅ Successfully stored {len(df_with_indicators)} records for {symbol}")
         except Exception as e:
             print(f"❌ Database insertion failed for {symbol}: {e}")
     
+    # Mark every stored symbol fresh in one transaction
+    if stored_symbols:
+        collector.db.update_last_fetch_times(stored_symbols)
+    
     # Check what's in database now
     print("\n--- Database Status After Collection ---")
-    import sqlite3
-    with sqlite3.connect(collector.db.db_path) as conn:
-        cursor = conn.execute('SELECT symbol, COUNT(*) FROM stock_data GROUP BY symbol ORDER BY symbol')
-        results = cursor.fetchall()
-        for symbol, count in results:
-            print(f"  {symbol}: {count} records")
+    summary = collector.db.get_summary(sample_size=len(WATCHLIST))
+    for symbol, count in summary['sample_data']:
+        print(f"  {symbol}: {count} records")
 
 def debug_api_calls():
     """Test individual API calls to see if there are issues"""
@@ -68,20 +78,30 @@ def debug_api_calls():
     
     print("Testing API calls for individual symbols...")
     
-    for symbol in WATCHLIST[:5]:  # Test first 5
+    test_symbols = WATCHLIST[:5]  # Test first 5
+    
+    async def fetch_all():
+        # Requests run concurrently; the collector's shared limiter enforces the quota
+        try:
+            return await asyncio.gather(
+                *(collector.fetch_daily_data(symbol, days=10) for symbol in test_symbols),  # Smaller dataset for testing
+                return_exceptions=True
+            )
+        finally:
+            await collector.close()
+    
+    for symbol, df in zip(test_symbols, asyncio.run(fetch_all())):
         print(f"\nTesting API call for {symbol}...")
         
-        try:
-            df = collector.fetch_daily_data(symbol, days=10)  # Smaller dataset for testing
-            if df is None:
-                print(f"  ❌ API call returned None for {symbol}")
-            elif df.empty:
-                print(f"  ❌ API call returned empty DataFrame for {symbol}")
-            else:
-                print(f"  ✅ API call successful: {len(df)} records for {symbol}")
-                print(f"     Latest record: {df.iloc[-1]['datetime']} - Close: ${df.iloc[-1]['close']:.2f}")
-        except Exception as e:
-            print(f"  ❌ API call failed for {symbol}: {e}")
+        if isinstance(df, Exception):
+            print(f"  ❌ API call failed for {symbol}: {df}")
+        elif df is None:
+            print(f"  ❌ API call returned None for {symbol}")
+        elif df.empty:
+            print(f"  ❌ API call returned empty DataFrame for {symbol}")
+        else:
+            print(f"  ✅ API call successful: {len(df)} records for {symbol}")
+            print(f"     Latest record: {df.iloc[-1]['datetime']} - Close: ${df.iloc[-1]['close']:.2f}")
 
 def main():
     """Run debug tests"""
@@ -1,19 +1,14 @@
+import asyncio
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import plotly.express as px
 import sys
-import os
 from pathlib import Path
 
 # Add project root to path for imports
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
-os.chdir(project_root)
 
-from src.database import StockDatabase
-from src.data_collector import PolygonDataCollector
+from src.database import StockDatabase, connect_shared
 from config.settings import WATCHLIST, OVERSOLD_THRESHOLD, MIN_DECLINE_PERCENT
 
 # Page configuration
@@ -24,29 +19,47 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+@st.cache_resource
+def get_db():
+    """Shared database handle and connection reused across reruns, sessions and threads"""
+    return StockDatabase(connect_shared())
+
+@st.cache_resource
+def get_collector():
+    """Shared data collector reused across reruns and sessions"""
+    # Deferred: the HTTP stack is only needed once a refresh is requested
+    from src.data_collector import PolygonDataCollector
+    # Writes go through the dashboard's connection, so the process keeps a
+    # single SQLite page cache and reads see refreshed data immediately
+    return PolygonDataCollector(get_db())
+
 @st.cache_data(ttl=300)  # Cache for 5 minutes
 def load_stock_data(symbol: str, limit: int = 100):
     """Load stock data from database with caching"""
     try:
-        db = StockDatabase()
-        data = db.get_stock_data(symbol, limit=limit)
-        if not data.empty:
-            st.write(f"Debug: Loaded {len(data)} records for {symbol}")
-        else:
-            st.write(f"Debug: No data found for {symbol} in database")
-        return data
+        db = get_db()
+        return db.get_stock_data(symbol, limit=limit)
     except Exception as e:
         st.error(f"Error loading data for {symbol}: {str(e)}")
         return pd.DataFrame()
 
+@st.cache_data(ttl=300)
+def load_stock_data_batch(symbols: tuple, limit: int = 100):
+    """Load recent data for several stocks with one query, keyed by symbol"""
+    try:
+        db = get_db()
+        data = db.get_stock_data_batch(list(symbols), limit_per_symbol=limit)
+        return {symbol: group for symbol, group in data.groupby('symbol')} if not data.empty else {}
+    except Exception as e:
+        st.error(f"Error loading data for {', '.join(symbols)}: {str(e)}")
+        return {}
+
 @st.cache_data(ttl=300)
 def load_oversold_stocks():
     """Load oversold stocks with caching"""
     try:
-        db = StockDatabase()
-        data = db.get_oversold_stocks()
-        st.write(f"Debug: Found {len(data)} oversold stocks")
-        return data
+        db = get_db()
+        return db.get_oversold_stocks()
     except Exception as e:
         st.error(f"Error loading oversold stocks: {str(e)}")
         return pd.DataFrame()
@@ -55,10 +68,8 @@ def load_oversold_stocks():
 def load_all_latest_data():
     """Load latest data for all stocks"""
     try:
-        db = StockDatabase()
-        data = db.get_all_latest_data()
-        st.write(f"Debug: Loaded latest data for {len(data)} stocks")
-        return data
+        db = get_db()
+        return db.get_all_latest_data()
     except Exception as e:
         st.error(f"Error loading all latest data: {str(e)}")
         return pd.DataFrame()
@@ -69,6 +80,10 @@ def create_candlestick_chart(df: pd.DataFrame, symbol: str):
         st.warning(f"No data available for {symbol}")
         return
     
+    # Plotly is imported on first chart so it stays off the dashboard's startup path
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    
     # Sort by datetime
     df = df.sort_values('datetime')
     df['datetime'] = pd.to_datetime(df['datetime'])
@@ -168,27 +183,12 @@ def display_stock_metrics(df: pd.DataFrame):
             rsi_color = "red" if latest['rsi'] < OVERSOLD_THRESHOLD else "normal"
             st.metric("RSI", f"{latest['rsi']:.1f}")
 
+@st.cache_data(ttl=30)
 def check_database_status():
     """Check if database has any data"""
     try:
-        import sqlite3
-        db = StockDatabase()
-        with sqlite3.connect(db.db_path) as conn:
-            cursor = conn.execute("SELECT COUNT(*) FROM stock_data")
-            total_records = cursor.fetchone()[0]
-            
-            cursor = conn.execute("SELECT COUNT(DISTINCT symbol) FROM stock_data") 
-            unique_symbols = cursor.fetchone()[0]
-            
-            cursor = conn.execute("SELECT symbol, COUNT(*) as records FROM stock_data GROUP BY symbol LIMIT 10")
-            sample_data = cursor.fetchall()
-            
-            return {
-                'total_records': total_records,
-                'unique_symbols': unique_symbols,
-                'sample_data': sample_data,
-                'db_path': db.db_path
-            }
+        db = get_db()
+        return {**db.get_summary(), 'db_path': db.db_path}
     except Exception as e:
         return {'error': str(e)}
 
@@ -217,9 +217,9 @@ def main():
     # Data refresh button
     if st.sidebar.button("🔄 Refresh Data"):
         st.cache_data.clear()
-        collector = PolygonDataCollector()
+        collector = get_collector()
         with st.spinner("Updating data..."):
-            results = collector.update_stale_data(hours_threshold=1)
+            results = asyncio.run(collector.update_stale_data(hours_threshold=1))
             if results:
                 st.sidebar.success(f"Updated {len(results)} symbols")
             else:
@@ -287,12 +287,14 @@ def main():
             if len(oversold_df) > 0:
                 st.subheader("Quick Charts - Top Oversold Stocks")
                 
-                for i, row in oversold_df.head(3).iterrows():
-                    symbol = row['symbol']
-                    st.write(f"**{symbol}** - RSI: {row['rsi']:.1f}")
+                top_oversold = oversold_df.head(3)
+                chart_data = load_stock_data_batch(tuple(top_oversold['symbol']), limit=50)
+                
+                for symbol, rsi in zip(top_oversold['symbol'], top_oversold['rsi']):
+                    st.write(f"**{symbol}** - RSI: {rsi:.1f}")
                     
-                    symbol_df = load_stock_data(symbol, limit=50)
-                    if not symbol_df.empty:
+                    symbol_df = chart_data.get(symbol)
+                    if symbol_df is not None and not symbol_df.empty:
                         fig = create_candlestick_chart(symbol_df, symbol)
                         if fig:
                             fig.update_layout(height=400)
@@ -306,11 +308,13 @@ def main():
         all_data = load_all_latest_data()
         
         if not all_data.empty:
+            import plotly.express as px
+            
             # Market summary metrics
             col1, col2, col3, col4 = st.columns(4)
             
             with col1:
-                oversold_count = len(all_data[all_data['is_oversold'] == 1])
+                oversold_count = int(all_data['is_oversold'].sum())
                 st.metric("Oversold Stocks", oversold_count)
             
             with col2:
@@ -318,7 +322,7 @@ def main():
                 st.metric("Average RSI", f"{avg_rsi:.1f}")
             
             with col3:
-                declining_count = len(all_data[all_data['pct_change_10d'] < -5])
+                declining_count = int((all_data['pct_change_10d'] < -5).sum())
                 st.metric("Declining Stocks (>5%)", declining_count)
             
             with col4:
@@ -1,84 +1,178 @@
-import requests
-import pandas as pd
+import asyncio
+import math
+import threading
 import time
+import aiohttp
+import orjson
+import pandas as pd
+from collections import deque
+from contextlib import nullcontext
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-import ta
+from typing import List, Dict, Optional, Tuple
 import sys
-import os
 from pathlib import Path
 
 # Add project root to path for imports
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
-os.chdir(project_root)
 
 from config.settings import (
     POLYGON_API_KEY, POLYGON_BASE_URL, WATCHLIST,
-    RSI_PERIOD, SMA_PERIOD, OVERSOLD_THRESHOLD,
-    MIN_DECLINE_PERCENT, DECLINE_LOOKBACK_DAYS
+    POLYGON_RATE_LIMIT_CALLS, POLYGON_RATE_LIMIT_PERIOD,
+    POLYGON_MAX_CONCURRENT_REQUESTS, POLYGON_REQUEST_TIMEOUT,
+    POLYGON_MAX_RETRIES, POLYGON_RETRY_BACKOFF,
+    RSI_PERIOD, SMA_PERIOD, DECLINE_LOOKBACK_DAYS
 )
 from src.database import StockDatabase
 
+# HTTP statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Polygon aggregate bar fields we keep, mapped to our column names and dtypes
+POLYGON_BAR_COLUMNS = {'t': 'datetime', 'o': 'open', 'h': 'high', 'l': 'low', 'c': 'close', 'v': 'volume'}
+POLYGON_BAR_DTYPES = {'t': 'int64', 'o': 'float64', 'h': 'float64', 'l': 'float64', 'c': 'float64', 'v': 'int64'}
+
+class RateLimiter:
+    """Allow at most `calls` requests in any `period` seconds
+    
+    State is guarded by a thread lock rather than tied to an event loop, so
+    one limiter enforces the quota across every asyncio.run in the process.
+    """
+    
+    def __init__(self, calls: int, period: float):
+        self.calls = calls
+        self.period = period
+        self._sent = deque()
+        self._lock = threading.Lock()
+    
+    async def acquire(self):
+        """Wait until a request may be sent and record it"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0] >= self.period:
+                    self._sent.popleft()
+                if len(self._sent) < self.calls:
+                    self._sent.append(now)
+                    return
+                wait = self.period - (now - self._sent[0])
+            await asyncio.sleep(wait)
+
+# The quota belongs to the API key, so every collector in the process shares it
+polygon_rate_limiter = RateLimiter(POLYGON_RATE_LIMIT_CALLS, POLYGON_RATE_LIMIT_PERIOD)
+
+def _compute_rsi(close: pd.DataFrame, n: int = RSI_PERIOD) -> pd.DataFrame:
+    """Wilder's RSI using vectorized exponential smoothing
+    
+    Works on a Series or on a (dates x symbols) frame; leading gaps in a
+    column are skipped so each symbol is smoothed from its own first bar.
+    """
+    delta = close.diff()
+    # The first bar has no prior close; count it as no change
+    delta = delta.where(delta.notna() | close.isna(), 0)
+    gain = delta.clip(lower=0).ewm(alpha=1 / n, min_periods=n, adjust=False).mean()
+    loss = (-delta.clip(upper=0)).ewm(alpha=1 / n, min_periods=n, adjust=False).mean()
+    rsi = 100 - 100 / (1 + gain / loss)
+    # No losses over the window means maximum strength
+    return rsi.where(loss != 0, 100.0)
+
+def _compute_indicators(close: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Compute all indicator columns from closes (a Series or a dates x symbols frame)"""
+    return {
+        'rsi': _compute_rsi(close, RSI_PERIOD),
+        'sma_20': close.rolling(SMA_PERIOD, min_periods=SMA_PERIOD).mean(),
+        'pct_change_5d': close.pct_change(periods=5, fill_method=None) * 100,
+        'pct_change_10d': close.pct_change(periods=DECLINE_LOOKBACK_DAYS, fill_method=None) * 100
+    }
+
 class PolygonDataCollector:
-    def __init__(self):
+    def __init__(self, db: Optional[StockDatabase] = None):
         self.api_key = POLYGON_API_KEY
         self.base_url = POLYGON_BASE_URL
-        self.db = StockDatabase()
-        self.rate_limit_delay = 12  # 5 calls per minute = 12 seconds between calls
+        self.db = db if db is not None else StockDatabase()
+        # One HTTP session and concurrency cap per event loop: a cached collector
+        # can be driven by several asyncio.run calls at once (one per dashboard session)
+        self._sessions: Dict[asyncio.AbstractEventLoop, Tuple[aiohttp.ClientSession, asyncio.Semaphore]] = {}
+        self._sessions_lock = threading.Lock()
+    
+    def _get_session(self) -> Tuple[aiohttp.ClientSession, asyncio.Semaphore]:
+        """Return the running loop's HTTP session and semaphore, creating them on first use"""
+        loop = asyncio.get_running_loop()
+        with self._sessions_lock:
+            session, semaphore = self._sessions.get(loop, (None, None))
+            if session is None or session.closed:
+                # Keep-alive connections to the API host are pooled and reused across requests
+                session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(limit=POLYGON_MAX_CONCURRENT_REQUESTS),
+                    timeout=aiohttp.ClientTimeout(total=POLYGON_REQUEST_TIMEOUT)
+                )
+                semaphore = asyncio.Semaphore(POLYGON_MAX_CONCURRENT_REQUESTS)
+                self._sessions[loop] = (session, semaphore)
+        return session, semaphore
     
-    def _make_request(self, endpoint: str, params: Dict) -> Optional[Dict]:
+    async def close(self):
+        """Close the running loop's HTTP session"""
+        with self._sessions_lock:
+            session, _ = self._sessions.pop(asyncio.get_running_loop(), (None, None))
+        if session is not None and not session.closed:
+            await session.close()
+    
+    async def _make_request(self, endpoint: str, params: Dict) -> Optional[Dict]:
         """Make API request with error handling and rate limiting"""
         params['apikey'] = self.api_key
         url = f"{self.base_url}{endpoint}"
         
         try:
-            response = requests.get(url, params=params)
-            time.sleep(self.rate_limit_delay)  # Rate limiting
+            session, semaphore = self._get_session()
+            for attempt in range(POLYGON_MAX_RETRIES + 1):
+                if attempt:
+                    # Exponential backoff before retrying a transient failure
+                    await asyncio.sleep(POLYGON_RETRY_BACKOFF * 2 ** (attempt - 1))
+                try:
+                    async with semaphore:
+                        await polygon_rate_limiter.acquire()
+                        async with session.get(url, params=params) as response:
+                            if response.status == 200:
+                                return orjson.loads(await response.read())
+                            error = f"{response.status} - {await response.text()}"
+                            if response.status not in RETRY_STATUS_CODES:
+                                break
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    error = str(e) or type(e).__name__
             
-            if response.status_code == 200:
-                return response.json()
-            else:
-                print(f"API Error for {endpoint}: {response.status_code} - {response.text}")
-                return None
+            print(f"API Error for {endpoint}: {error}")
+            return None
         except Exception as e:
             print(f"Request failed for {endpoint}: {str(e)}")
             return None
     
-    def fetch_daily_data(self, symbol: str, days: int = 100) -> Optional[pd.DataFrame]:
-        """Fetch daily OHLCV data for a symbol"""
+    async def fetch_daily_data(self, symbol: str, days: int = 100,
+                               start_date: Optional[datetime] = None) -> Optional[pd.DataFrame]:
+        """Fetch daily OHLCV data for a symbol, from start_date if given or the last `days` days"""
         end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
+        if start_date is None:
+            start_date = end_date - timedelta(days=days)
         
         endpoint = f"/v2/aggs/ticker/{symbol}/range/1/day/{start_date.strftime('%Y-%m-%d')}/{end_date.strftime('%Y-%m-%d')}"
         params = {'adjusted': 'true', 'sort': 'asc'}
         
-        data = self._make_request(endpoint, params)
-        if not data or 'results' not in data:
-            return None
-        
-        df = pd.DataFrame(data['results'])
-        if df.empty:
+        data = await self._make_request(endpoint, params)
+        if not data:
             return None
         
-        # Convert timestamp to datetime
-        df['datetime'] = pd.to_datetime(df['t'], unit='ms')
-        df['symbol'] = symbol
-        df['timeframe'] = 'daily'
-        
-        # Rename columns to match our schema
-        df = df.rename(columns={
-            'o': 'open',
-            'h': 'high',
-            'l': 'low',
-            'c': 'close',
-            'v': 'volume'
-        })
-        
-        # Select and order columns
-        df = df[['symbol', 'datetime', 'timeframe', 'open', 'high', 'low', 'close', 'volume']]
-        df['datetime'] = df['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')
+        # Polygon omits 'results' when there are no bars in the range
+        results = data.get('results')
+        if not results:
+            return pd.DataFrame()
         
+        # Build the frame from a fixed field list with known dtypes so pandas skips
+        # inference; timestamps stay native datetime64 and are only formatted once,
+        # at the database boundary
+        df = pd.DataFrame.from_records(results, columns=list(POLYGON_BAR_COLUMNS))
+        df = df.astype(POLYGON_BAR_DTYPES).rename(columns=POLYGON_BAR_COLUMNS)
+        df['datetime'] = pd.to_datetime(df['datetime'], unit='ms')
+        df.insert(0, 'symbol', symbol)
+        df.insert(2, 'timeframe', 'daily')
         return df
     
     def calculate_indicators(self, df: pd.DataFrame) -> pd.DataFrame:
@@ -89,65 +183,149 @@ class PolygonDataCollector:
         # Sort by datetime to ensure proper calculation
         df = df.sort_values('datetime').copy()
         
-        # Calculate RSI
-        df['rsi'] = ta.momentum.RSIIndicator(
-            close=df['close'], 
-            window=RSI_PERIOD
-        ).rsi()
+        # Calculate RSI, SMA and percentage changes
+        for column, values in _compute_indicators(df['close']).items():
+            df[column] = values
+        
+        return df
+    
+    def calculate_indicators_batch(self, frames: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+        """Calculate technical indicators for many symbols in one vectorized pass
         
-        # Calculate SMA
-        df['sma_20'] = ta.trend.SMAIndicator(
-            close=df['close'], 
-            window=SMA_PERIOD
-        ).sma_indicator()
+        Closes are pivoted into a (dates x symbols) matrix so every indicator
+        runs once over all symbols. Symbols with missing bars inside their
+        range, or too little data, fall back to calculate_indicators.
+        """
+        if not frames:
+            return {}
         
-        # Calculate percentage changes
-        df['pct_change_5d'] = df['close'].pct_change(periods=5) * 100
-        df['pct_change_10d'] = df['close'].pct_change(periods=DECLINE_LOOKBACK_DAYS) * 100
+        data = pd.concat(frames.values(), ignore_index=True).sort_values(['symbol', 'datetime'])
+        close = data.pivot(index='datetime', columns='symbol', values='close').sort_index()
         
-        # Mark oversold conditions
-        df['is_oversold'] = (
-            (df['rsi'] < OVERSOLD_THRESHOLD) & 
-            (df['pct_change_10d'] < -MIN_DECLINE_PERCENT)
-        ).astype(int)
+        # A gap between a symbol's first and last bar would shift its rolling windows
+        present = close.notna()
+        has_gap = (present.cummax() & present[::-1].cummax()[::-1] & ~present).any()
+        too_short = present.sum() < max(RSI_PERIOD, SMA_PERIOD)
+        separate = set(close.columns[has_gap | too_short])
         
-        return df
+        indicators = pd.DataFrame({
+            column: values.drop(columns=list(separate)).unstack()
+            for column, values in _compute_indicators(close).items()
+        })
+        data = data[~data['symbol'].isin(separate)].join(indicators, on=['symbol', 'datetime'])
+        
+        results = {symbol: group for symbol, group in data.groupby('symbol', sort=False)}
+        for symbol in separate:
+            results[symbol] = self.calculate_indicators(frames[symbol])
+        return results
     
-    def collect_data_for_symbol(self, symbol: str) -> bool:
-        """Collect and process data for a single symbol"""
+    async def collect_data_for_symbol(self, symbol: str, days: int = 100) -> Optional[pd.DataFrame]:
+        """Fetch the raw bars for a single symbol from its last completed stored bar onwards
+        
+        Re-fetching from the last bar before today replaces any bar that was
+        stored mid-session. If that bar's close has changed since it was stored
+        (e.g. a split adjustment), the whole window is fetched again so the
+        history stays consistent. Returns None if the fetch failed.
+        """
         print(f"Collecting data for {symbol}...")
         
+        now = datetime.now()
+        reference = self.db.get_latest_row(symbol, before=datetime.combine(now.date(), datetime.min.time()))
+        if reference is not None and reference[0] < now - timedelta(days=days):
+            reference = None
+        
         # Fetch raw data
-        df = self.fetch_daily_data(symbol)
-        if df is None or df.empty:
+        df = await self.fetch_daily_data(symbol, days=days, start_date=reference[0] if reference else None)
+        if df is None:
             print(f"No data retrieved for {symbol}")
-            return False
+            return None
+        
+        if reference is not None:
+            reference_datetime, reference_close = reference
+            refetched = df.loc[df['datetime'] == reference_datetime, 'close']
+            if not refetched.empty and not math.isclose(refetched.iloc[0], reference_close, rel_tol=1e-9):
+                print(f"Stored prices for {symbol} were revised, fetching the full window")
+                df = await self.fetch_daily_data(symbol, days=days)
+                if df is None:
+                    print(f"No data retrieved for {symbol}")
+                    return None
+        
+        if df.empty:
+            print(f"No new data for {symbol}")
+        return df
+    
+    def process_new_data(self, new_data: Dict[str, pd.DataFrame], days: int = 100) -> Dict[str, pd.DataFrame]:
+        """Calculate indicators for newly fetched bars of every symbol
         
-        # Calculate indicators
-        df = self.calculate_indicators(df)
+        Stored bars from the same window that precede the fetched ones are
+        prepended so the indicators see the same history as a full fetch; only
+        the fetched bars are returned.
+        """
+        window_start = datetime.now() - timedelta(days=days)
+        
+        combined = {symbol: df for symbol, df in new_data.items() if not df.empty}
+        
+        # Stored history for every symbol comes back from one query
+        history = self.db.get_price_history_batch(list(combined), window_start)
+        for symbol, stored in (history.groupby('symbol', sort=False) if not history.empty else ()):
+            # Fetched bars replace stored ones from the same dates (the re-fetched
+            # latest bar, or everything after a full-window fetch)
+            stored = stored[stored['datetime'] < combined[symbol]['datetime'].min()]
+            combined[symbol] = pd.concat([stored, combined[symbol]], ignore_index=True)
+        
+        processed = self.calculate_indicators_batch(combined)
+        return {
+            symbol: processed[symbol][processed[symbol]['datetime'] >= df['datetime'].min()]
+            if symbol in processed else df
+            for symbol, df in new_data.items()
+        }
+    
+    def store_data(self, frames: Dict[str, pd.DataFrame], bulk_load: bool = False) -> bool:
+        """Store processed data for all symbols with a single bulk insert
+        
+        bulk_load skips journaling fsyncs and is meant for the initial backfill only.
+        """
+        if not frames:
+            return False
         
-        # Store in database
         try:
-            self.db.insert_stock_data(df)
-            self.db.update_last_fetch_time(symbol)
-            print(f"Successfully stored {len(df)} records for {symbol}")
+            new_data = [df for df in frames.values() if not df.empty]
+            with self.db.bulk_load_mode() if bulk_load else nullcontext(False) as bulk_enabled:
+                if bulk_load and not bulk_enabled:
+                    print("Bulk load mode unavailable while the database is in use, using normal writes")
+                if new_data:
+                    self.db.insert_stock_data(pd.concat(new_data, ignore_index=True))
+                self.db.update_last_fetch_times(list(frames))
+            for symbol, df in frames.items():
+                print(f"Successfully stored {len(df)} records for {symbol}")
             return True
         except Exception as e:
-            print(f"Error storing data for {symbol}: {str(e)}")
+            print(f"Error storing data for {list(frames)}: {str(e)}")
             return False
     
-    def collect_all_data(self, symbols: Optional[List[str]] = None) -> Dict[str, bool]:
-        """Collect data for all symbols in watchlist"""
+    async def collect_all_data(self, symbols: Optional[List[str]] = None) -> Dict[str, bool]:
+        """Collect data for all symbols in watchlist concurrently"""
         if symbols is None:
             symbols = WATCHLIST
         
-        results = {}
-        for symbol in symbols:
-            results[symbol] = self.collect_data_for_symbol(symbol)
-            
-        return results
+        # An empty database can be rebuilt by re-running, so its first load skips fsyncs
+        initial_load = not self.db.has_data()
+        
+        try:
+            fetched = await asyncio.gather(
+                *(self.collect_data_for_symbol(symbol) for symbol in symbols)
+            )
+        finally:
+            await self.close()
+        
+        frames = self.process_new_data(
+            {symbol: df for symbol, df in zip(symbols, fetched) if df is not None}
+        )
+        stored = self.store_data(frames, bulk_load=initial_load)
+        
+        return {symbol: stored and symbol in frames for symbol in symbols}
     
-    def update_stale_data(self, hours_threshold: int = 1) -> Dict[str, bool]:
+    async def update_stale_data(self, hours_threshold: int = 1) -> Dict[str, bool]:
         """Update data for symbols that haven't been updated recently"""
         symbols_needing_update = self.db.get_symbols_needing_update(hours_threshold)
         
@@ -156,7 +334,7 @@ class PolygonDataCollector:
             return {}
         
         print(f"Updating {len(symbols_needing_update)} symbols: {symbols_needing_update}")
-        return self.collect_all_data(symbols_needing_update)
+        return await self.collect_all_data(symbols_needing_update)
 
 def main():
     """Main function for running data collection"""
@@ -168,7 +346,7 @@ def main():
         return
     
     # Collect data for all symbols
-    results = collector.collect_all_data()
+    results = asyncio.run(collector.collect_all_data())
     
     # Print summary
     successful = sum(1 for success in results.values() if success)
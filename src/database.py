@@ -1,26 +1,185 @@
 import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
 import pandas as pd
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import List, Optional
-from config.settings import DATABASE_PATH
+from typing import Iterator, List, Optional
+from config.settings import DATABASE_PATH, OVERSOLD_THRESHOLD, MIN_DECLINE_PERCENT
+
+# Column order used for bulk inserts into stock_data
+STOCK_DATA_COLUMNS = [
+    'symbol', 'datetime', 'timeframe', 'open', 'high', 'low', 'close', 'volume',
+    'rsi', 'sma_20', 'pct_change_5d', 'pct_change_10d'
+]
+STOCK_DATA_KEY = ('symbol', 'datetime', 'timeframe')
+
+# Explicit projection for reads: skips bookkeeping columns such as created_at
+STOCK_DATA_SELECT = ', '.join(STOCK_DATA_COLUMNS)
+
+# Rows per multi-row INSERT; 500 x 12 columns stays well under SQLite's
+# 32766 bound-parameter limit
+INSERT_BATCH_ROWS = 500
+
+# Query results kept in memory per StockDatabase until the data changes
+QUERY_CACHE_SIZE = 128
+
+# Oversold flag is derived at read time so threshold changes apply without re-collecting
+OVERSOLD_CONDITION = 'rsi < ? AND pct_change_10d < ?'
+IS_OVERSOLD_COLUMN = f'COALESCE({OVERSOLD_CONDITION}, 0) AS is_oversold'
+
+def _oversold_params() -> tuple:
+    """Bind parameters for OVERSOLD_CONDITION from the current settings"""
+    return (OVERSOLD_THRESHOLD, -MIN_DECLINE_PERCENT)
+
+# Numeric result columns; typed up front so all-NULL indicator columns
+# (short histories) still come back as float rather than object
+RESULT_DTYPES = {
+    'open': 'float64', 'high': 'float64', 'low': 'float64', 'close': 'float64',
+    'volume': 'int64', 'rsi': 'float64', 'sma_20': 'float64',
+    'pct_change_5d': 'float64', 'pct_change_10d': 'float64', 'is_oversold': 'int64'
+}
+
+def _read_frame(conn: sqlite3.Connection, query: str, params: tuple = ()) -> pd.DataFrame:
+    """Run a query and build a DataFrame straight from the cursor rows"""
+    cursor = conn.execute(query, params)
+    columns = [description[0] for description in cursor.description]
+    df = pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
+    if 'datetime' in df.columns:
+        df['datetime'] = pd.to_datetime(df['datetime'], unit='s')
+    return df.astype({col: dtype for col, dtype in RESULT_DTYPES.items() if col in df.columns})
+
+def _epoch_seconds(values: pd.Series) -> pd.Series:
+    """Convert timestamps (or timestamp strings) to integer unix seconds"""
+    return (pd.to_datetime(values) - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+
+def connect_shared(db_path: str = DATABASE_PATH) -> sqlite3.Connection:
+    """Open an autocommit connection that may be shared between threads by one StockDatabase"""
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    return sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
 
 class StockDatabase:
-    def __init__(self):
+    def __init__(self, conn: Optional[sqlite3.Connection] = None):
         self.db_path = DATABASE_PATH
         self._ensure_database_exists()
+        if conn is None:
+            # One long-lived connection per instance, closed when it is garbage
+            # collected or at interpreter exit
+            conn = connect_shared(self.db_path)
+            weakref.finalize(self, conn.close)
+        self._conn = conn
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()
+        self._cache_version = None
+        self._write_count = 0
+        self._configure(conn)
         self._create_tables()
+        self._load_last_updates()
     
     def _ensure_database_exists(self):
         """Create database directory if it doesn't exist"""
         Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
     
+    def _configure(self, conn: sqlite3.Connection):
+        """Apply per-connection pragmas (WAL itself is persisted in the file)"""
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        conn.execute('PRAGMA cache_size = -65536')  # 64 MB page cache
+        conn.execute('PRAGMA mmap_size = 268435456')  # Map up to 256 MB of the file for reads
+    
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Yield the connection, committing on success and rolling back on error
+        
+        The connection is used under a lock: transactions on a single
+        connection cannot interleave between threads.
+        """
+        with self._lock, self._conn:
+            yield self._conn
+    
+    @contextmanager
+    def bulk_load_mode(self) -> Iterator[bool]:
+        """Turn off journaling fsyncs for an initial backfill, restoring WAL afterwards
+        
+        Yields whether the mode could be enabled: leaving WAL needs exclusive
+        access, so while other connections are open writes stay as they are.
+        A crash during the load can leave the database unusable, so only use
+        this for loads that can simply be re-run from an empty database.
+        """
+        with self._lock:
+            # Fail fast rather than waiting out the busy timeout if the database is in use
+            busy_timeout = self._conn.execute('PRAGMA busy_timeout').fetchone()[0]
+            self._conn.execute('PRAGMA busy_timeout = 0')
+            try:
+                journal_mode = self._conn.execute('PRAGMA journal_mode = MEMORY').fetchone()[0]
+            except sqlite3.OperationalError:
+                journal_mode = None
+            finally:
+                self._conn.execute(f'PRAGMA busy_timeout = {int(busy_timeout)}')
+            
+            enabled = journal_mode == 'memory'
+            if enabled:
+                self._conn.execute('PRAGMA synchronous = OFF')
+            try:
+                yield enabled
+            finally:
+                if enabled:
+                    self._conn.execute('PRAGMA synchronous = NORMAL')
+                    self._conn.execute('PRAGMA journal_mode = WAL')
+    
+    def has_data(self) -> bool:
+        """Check whether any bars have been stored yet"""
+        with self._connect() as conn:
+            return conn.execute('SELECT 1 FROM latest_stock_data LIMIT 1').fetchone() is not None
+    
+    def _cached_query(self, query: str, params: tuple) -> pd.DataFrame:
+        """Run a read query, reusing the result until the database changes
+        
+        PRAGMA data_version moves when another connection commits, and the
+        write counter covers commits made through this one; file mtimes are
+        unreliable under WAL.
+        """
+        with self._connect() as conn:
+            version = (conn.execute('PRAGMA data_version').fetchone()[0], self._write_count)
+            if version != self._cache_version:
+                self._cache.clear()
+                self._cache_version = version
+            
+            key = (query, params)
+            if key in self._cache:
+                self._cache.move_to_end(key)
+            else:
+                self._cache[key] = _read_frame(conn, query, params)
+                if len(self._cache) > QUERY_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+            # Copy so callers can modify the result without touching the cache
+            return self._cache[key].copy()
+    
     def _create_tables(self):
         """Create database tables if they don't exist"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
+            # WAL is persistent: readers no longer block behind the collector's writes
+            conn.execute('PRAGMA journal_mode = WAL')
+            
+            # Databases from before datetime was stored as epoch seconds keep it as
+            # text (and may still carry is_oversold); they are rebuilt below
+            column_types = {row[1]: row[2] for row in conn.execute('PRAGMA table_info(stock_data)')}
+            legacy = 'datetime' in column_types and column_types['datetime'] != 'INTEGER'
+            
+            conn.execute('BEGIN IMMEDIATE')
+            if legacy:
+                conn.execute('ALTER TABLE stock_data RENAME TO stock_data_legacy')
+                conn.execute('DROP TABLE IF EXISTS latest_stock_data')
+            
+            # datetime is unix seconds: 8-byte integer keys compare and index
+            # more cheaply than ISO-8601 text
             conn.execute('''
                 CREATE TABLE IF NOT EXISTS stock_data (
                     symbol TEXT NOT NULL,
-                    datetime TEXT NOT NULL,
+                    datetime INTEGER NOT NULL,
                     timeframe TEXT NOT NULL,
                     open REAL NOT NULL,
                     high REAL NOT NULL,
@@ -31,100 +190,245 @@ class StockDatabase:
                     sma_20 REAL,
                     pct_change_5d REAL,
                     pct_change_10d REAL,
-                    is_oversold BOOLEAN,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     PRIMARY KEY (symbol, datetime, timeframe)
                 )
             ''')
             
+            if legacy:
+                # Tables written by DataFrame.to_sql have no created_at column
+                copied = STOCK_DATA_COLUMNS + (['created_at'] if 'created_at' in column_types else [])
+                converted = [
+                    "CAST(strftime('%s', datetime) AS INTEGER)" if col == 'datetime' else col
+                    for col in copied
+                ]
+                conn.execute(f'''
+                    INSERT INTO stock_data ({', '.join(copied)})
+                    SELECT {', '.join(converted)} FROM stock_data_legacy
+                ''')
+                conn.execute('DROP TABLE stock_data_legacy')
+            
+            # Serves latest-row-per-symbol lookups as one ordered index walk
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_stock_data_symbol_timeframe_datetime
+                ON stock_data (symbol, timeframe, datetime DESC)
+            ''')
+            
+            # Newest row per symbol, kept current by insert_stock_data so the
+            # dashboard's latest-data queries read a handful of rows
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS latest_stock_data (
+                    symbol TEXT NOT NULL,
+                    datetime INTEGER NOT NULL,
+                    timeframe TEXT NOT NULL,
+                    open REAL NOT NULL,
+                    high REAL NOT NULL,
+                    low REAL NOT NULL,
+                    close REAL NOT NULL,
+                    volume INTEGER NOT NULL,
+                    rsi REAL,
+                    sma_20 REAL,
+                    pct_change_5d REAL,
+                    pct_change_10d REAL,
+                    PRIMARY KEY (symbol, timeframe)
+                )
+            ''')
+            if conn.execute('SELECT 1 FROM latest_stock_data LIMIT 1').fetchone() is None:
+                self._refresh_latest(conn)
+            
+            # last_update is unix seconds so freshness checks are one integer compare
             conn.execute('''
                 CREATE TABLE IF NOT EXISTS data_updates (
                     symbol TEXT PRIMARY KEY,
-                    last_update TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    last_update INTEGER NOT NULL
                 )
             ''')
-            
+            # Older tables declare TIMESTAMP (numeric affinity), so their text
+            # values can be converted in place
+            conn.execute('''
+                UPDATE data_updates SET last_update = CAST(strftime('%s', last_update) AS INTEGER)
+                WHERE typeof(last_update) = 'text'
+            ''')
             conn.commit()
     
     def insert_stock_data(self, df: pd.DataFrame):
-        """Insert stock data DataFrame into database"""
-        with sqlite3.connect(self.db_path) as conn:
-            # Delete existing data for this symbol and timeframe first
-            if not df.empty:
-                symbol = df.iloc[0]['symbol']
-                timeframe = df.iloc[0]['timeframe']
-                conn.execute('DELETE FROM stock_data WHERE symbol = ? AND timeframe = ?', (symbol, timeframe))
-            
-            # Insert new data
-            df.to_sql('stock_data', conn, if_exists='append', index=False)
+        """Insert or update stock data rows (one or many symbols) in a single transaction"""
+        if df.empty:
+            return
+        
+        columns = [col for col in STOCK_DATA_COLUMNS if col in df.columns]
+        records = df[columns]
+        records = records.assign(datetime=_epoch_seconds(records['datetime']))
+        rows = list(records.itertuples(index=False, name=None))
+        
+        # Upsert on the primary key so earlier history (and created_at) is kept
+        row_placeholders = f"({', '.join('?' * len(columns))})"
+        updates = ', '.join(f'{col} = excluded.{col}' for col in columns if col not in STOCK_DATA_KEY)
+        conflict_clause = f"ON CONFLICT ({', '.join(STOCK_DATA_KEY)}) DO UPDATE SET {updates}"
+        
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # Many rows per statement means far fewer statement executions than one per row
+            for start in range(0, len(rows), INSERT_BATCH_ROWS):
+                chunk = rows[start:start + INSERT_BATCH_ROWS]
+                conn.execute(
+                    f"INSERT INTO stock_data ({', '.join(columns)}) "
+                    f"VALUES {', '.join([row_placeholders] * len(chunk))} {conflict_clause}",
+                    [value for row in chunk for value in row]
+                )
+            self._refresh_latest(conn, list(records['symbol'].unique()))
             conn.commit()
+            self._write_count += 1
+    
+    def _refresh_latest(self, conn: sqlite3.Connection, symbols: Optional[List[str]] = None):
+        """Rebuild latest_stock_data rows for the given symbols (all symbols if None)"""
+        columns = ', '.join(STOCK_DATA_COLUMNS)
+        where = ''
+        if symbols is not None:
+            where = f"WHERE symbol IN ({', '.join('?' * len(symbols))})"
+        conn.execute(f'''
+            INSERT OR REPLACE INTO latest_stock_data ({columns})
+            SELECT {columns} FROM stock_data
+            JOIN (
+                SELECT symbol, timeframe, MAX(datetime) AS datetime
+                FROM stock_data {where}
+                GROUP BY symbol, timeframe
+            ) USING (symbol, timeframe, datetime)
+        ''', symbols or ())
+    
+    def get_latest_row(self, symbol: str, timeframe: str = 'daily',
+                       before: Optional[datetime] = None) -> Optional[tuple]:
+        """Get (datetime, close) of the most recent bar for a symbol without building a DataFrame
+        
+        With `before`, only bars strictly earlier than it are considered.
+        """
+        with self._connect() as conn:
+            if before is None:
+                row = conn.execute(
+                    'SELECT datetime, close FROM latest_stock_data WHERE symbol = ? AND timeframe = ?',
+                    (symbol, timeframe)
+                ).fetchone()
+            else:
+                row = conn.execute('''
+                    SELECT datetime, close FROM stock_data
+                    WHERE symbol = ? AND timeframe = ? AND datetime < ?
+                    ORDER BY datetime DESC LIMIT 1
+                ''', (symbol, timeframe, int(pd.Timestamp(before).timestamp()))).fetchone()
+        if row is None:
+            return None
+        return datetime.fromtimestamp(row[0], timezone.utc).replace(tzinfo=None), row[1]
+    
+    def get_price_history_batch(self, symbols: List[str], since: datetime, timeframe: str = 'daily') -> pd.DataFrame:
+        """Retrieve raw OHLCV rows for several symbols from `since` onwards, oldest first"""
+        if not symbols:
+            return pd.DataFrame()
+        
+        placeholders = ', '.join('?' * len(symbols))
+        query = f'''
+            SELECT symbol, datetime, timeframe, open, high, low, close, volume
+            FROM stock_data
+            WHERE timeframe = ? AND symbol IN ({placeholders}) AND datetime >= ?
+            ORDER BY symbol, datetime
+        '''
+        with self._connect() as conn:
+            # Naive Timestamps convert as UTC, matching how bars are stored
+            return _read_frame(conn, query, (timeframe, *symbols, int(pd.Timestamp(since).timestamp())))
     
     def get_stock_data(self, symbol: str, timeframe: str = 'daily', limit: Optional[int] = None) -> pd.DataFrame:
         """Retrieve stock data for a specific symbol"""
-        query = '''
-            SELECT * FROM stock_data 
+        query = f'''
+            SELECT {STOCK_DATA_SELECT}, {IS_OVERSOLD_COLUMN} FROM stock_data
             WHERE symbol = ? AND timeframe = ?
             ORDER BY datetime DESC
+            LIMIT ?
         '''
-        if limit:
-            query += f' LIMIT {limit}'
-            
-        with sqlite3.connect(self.db_path) as conn:
-            return pd.read_sql_query(query, conn, params=(symbol, timeframe))
+        # LIMIT -1 is unbounded, so one statement text serves every call
+        return self._cached_query(query, (*_oversold_params(), symbol, timeframe, limit or -1))
+    
+    def get_stock_data_batch(self, symbols: List[str], timeframe: str = 'daily', limit_per_symbol: int = 100) -> pd.DataFrame:
+        """Retrieve the most recent rows for several symbols with a single query"""
+        if not symbols:
+            return pd.DataFrame()
+        
+        placeholders = ', '.join('?' * len(symbols))
+        query = f'''
+            SELECT * FROM (
+                SELECT {STOCK_DATA_SELECT}, {IS_OVERSOLD_COLUMN},
+                       ROW_NUMBER() OVER (PARTITION BY symbol ORDER BY datetime DESC) AS row_num
+                FROM stock_data
+                WHERE timeframe = ? AND symbol IN ({placeholders})
+            )
+            WHERE row_num <= ?
+            ORDER BY symbol, datetime DESC
+        '''
+        df = self._cached_query(query, (*_oversold_params(), timeframe, *symbols, limit_per_symbol))
+        return df.drop(columns='row_num')
     
     def get_all_latest_data(self, timeframe: str = 'daily') -> pd.DataFrame:
         """Get latest data for all symbols"""
-        query = '''
-            SELECT * FROM stock_data s1
-            WHERE s1.timeframe = ? AND s1.datetime = (
-                SELECT MAX(s2.datetime) 
-                FROM stock_data s2 
-                WHERE s2.symbol = s1.symbol AND s2.timeframe = s1.timeframe
-            )
-            ORDER BY s1.symbol
+        query = f'''
+            SELECT {STOCK_DATA_SELECT}, {IS_OVERSOLD_COLUMN} FROM latest_stock_data
+            WHERE timeframe = ?
+            ORDER BY symbol
         '''
-        with sqlite3.connect(self.db_path) as conn:
-            return pd.read_sql_query(query, conn, params=(timeframe,))
+        return self._cached_query(query, (*_oversold_params(), timeframe))
     
     def get_oversold_stocks(self, timeframe: str = 'daily') -> pd.DataFrame:
         """Get stocks that are currently oversold"""
-        query = '''
-            SELECT * FROM stock_data s1
-            WHERE s1.timeframe = ? AND s1.is_oversold = 1 
-            AND s1.datetime = (
-                SELECT MAX(s2.datetime) 
-                FROM stock_data s2 
-                WHERE s2.symbol = s1.symbol AND s2.timeframe = s1.timeframe
-            )
-            ORDER BY s1.rsi ASC
+        query = f'''
+            SELECT {STOCK_DATA_SELECT}, 1 AS is_oversold FROM latest_stock_data
+            WHERE timeframe = ? AND {OVERSOLD_CONDITION}
+            ORDER BY rsi ASC
         '''
-        with sqlite3.connect(self.db_path) as conn:
-            return pd.read_sql_query(query, conn, params=(timeframe,))
+        return self._cached_query(query, (timeframe, *_oversold_params()))
+    
+    def get_summary(self, sample_size: int = 10) -> dict:
+        """Get record counts for the whole table and a sample of symbols"""
+        with self._connect() as conn:
+            total_records = conn.execute('SELECT COUNT(*) FROM stock_data').fetchone()[0]
+            unique_symbols = conn.execute('SELECT COUNT(DISTINCT symbol) FROM stock_data').fetchone()[0]
+            sample_data = conn.execute(
+                'SELECT symbol, COUNT(*) AS records FROM stock_data GROUP BY symbol LIMIT ?',
+                (sample_size,)
+            ).fetchall()
+        
+        return {
+            'total_records': total_records,
+            'unique_symbols': unique_symbols,
+            'sample_data': sample_data
+        }
     
     def update_last_fetch_time(self, symbol: str):
         """Update the last fetch time for a symbol"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
+        self.update_last_fetch_times([symbol])
+    
+    def update_last_fetch_times(self, symbols: List[str]):
+        """Update the last fetch time for several symbols in one transaction"""
+        with self._connect() as conn:
+            conn.execute('BEGIN')
+            now = int(time.time())
+            conn.executemany('''
                 INSERT OR REPLACE INTO data_updates (symbol, last_update)
-                VALUES (?, CURRENT_TIMESTAMP)
-            ''', (symbol,))
+                VALUES (?, ?)
+            ''', [(symbol, now) for symbol in symbols])
             conn.commit()
+            self._last_update.update(dict.fromkeys(symbols, now))
+    
+    def _load_last_updates(self):
+        """Reload the in-memory copy of data_updates"""
+        with self._connect() as conn:
+            self._last_update = dict(conn.execute('SELECT symbol, last_update FROM data_updates'))
     
     def get_symbols_needing_update(self, hours_threshold: int = 1) -> List[str]:
         """Get symbols that haven't been updated in the specified hours"""
         from config.settings import WATCHLIST
         
-        with sqlite3.connect(self.db_path) as conn:
-            symbols_needing_update = []
-            
-            for symbol in WATCHLIST:
-                query = '''
-                    SELECT last_update FROM data_updates 
-                    WHERE symbol = ? AND datetime(last_update) >= datetime('now', '-{} hours')
-                '''.format(hours_threshold)
-                
-                result = conn.execute(query, (symbol,)).fetchone()
-                if not result:
-                    symbols_needing_update.append(symbol)
-            
-            return symbols_needing_update
\ No newline at end of file
+        cutoff = time.time() - hours_threshold * 3600
+        with self._lock:
+            # Answered from memory; the table is only re-read to confirm symbols
+            # that look stale, in case another connection has updated them
+            stale = [symbol for symbol in WATCHLIST if self._last_update.get(symbol, 0) < cutoff]
+            if stale:
+                self._load_last_updates()
+                stale = [symbol for symbol in stale if self._last_update.get(symbol, 0) < cutoff]
+        return stale
\ No newline at end of file
@@ -3,6 +3,7 @@
 Test script to verify data collection and database operations
 """
 
+import asyncio
 import sys
 import os
 from pathlib import Path
@@ -32,24 +33,23 @@ def test_database_operations():
             return False
             
         # Test data retrieval
-        import sqlite3
-        with sqlite3.connect(db.db_path) as conn:
-            cursor = conn.execute("SELECT COUNT(*) FROM stock_data")
-            total_records = cursor.fetchone()[0]
-            print(f"Total records in database: {total_records}")
+        summary = db.get_summary(sample_size=5)
+        total_records = summary['total_records']
+        print(f"Total records in database: {total_records}")
+        
+        if total_records > 0:
+            symbols = [symbol for symbol, _ in summary['sample_data']]
+            print(f"Sample symbols: {symbols}")
             
-            if total_records > 0:
-                cursor = conn.execute("SELECT DISTINCT symbol FROM stock_data LIMIT 5")
-                symbols = [row[0] for row in cursor.fetchall()]
-                print(f"Sample symbols: {symbols}")
-                
-                # Test specific symbol retrieval
-                test_symbol = symbols[0] if symbols else 'AAPL'
-                data = db.get_stock_data(test_symbol)
-                print(f"Retrieved {len(data)} records for {test_symbol}")
-                
-                if not data.empty:
-                    print(f"   Latest record: {data.iloc[0]['datetime']} - Close: ${data.iloc[0]['close']:.2f}")
+            # Test specific symbol retrieval
+            test_symbol = symbols[0] if symbols else 'AAPL'
+            latest = db.get_latest_row(test_symbol)
+            
+            if latest:
+                latest_datetime, latest_close = latest
+                print(f"Latest record for {test_symbol}: {latest_datetime} - Close: ${latest_close:.2f}")
+            else:
+                print(f"No records found for {test_symbol}")
                 
         return True
         
@@ -57,6 +57,47 @@ def test_database_operations():
         print(f"Database test failed: {e}")
         return False
 
+def test_insert_keeps_other_symbols():
+    """Test that inserts upsert rows, keeping other symbols' and earlier history intact"""
+    print("\nTesting per-symbol inserts...")
+    
+    try:
+        import sqlite3
+        import pandas as pd
+        from src.database import StockDatabase
+        
+        # Scratch in-memory database so the real one is untouched
+        db = StockDatabase(sqlite3.connect(':memory:', isolation_level=None))
+        
+        def bars(symbol, dates, close=1.0):
+            return pd.DataFrame({
+                'symbol': symbol, 'datetime': pd.to_datetime(dates), 'timeframe': 'daily',
+                'open': 1.0, 'high': 1.0, 'low': 1.0, 'close': close, 'volume': 100
+            })
+        
+        db.insert_stock_data(bars('BBB', ['2024-01-01', '2024-01-02', '2024-01-03']))
+        rows_before = len(db.get_stock_data('BBB'))
+        
+        db.insert_stock_data(bars('AAA', ['2024-01-02', '2024-01-03']))
+        rows_after = len(db.get_stock_data('BBB'))
+        
+        assert rows_after == rows_before == 3, f"BBB rows changed from {rows_before} to {rows_after}"
+        print(f"Inserting AAA kept all {rows_after} BBB records")
+        
+        # An incremental update overlapping the stored range keeps earlier history
+        db.insert_stock_data(bars('BBB', ['2024-01-03', '2024-01-04'], close=2.0))
+        data = db.get_stock_data('BBB').set_index('datetime')
+        
+        assert len(data) == 4, f"BBB has {len(data)} records after an overlapping insert, expected 4"
+        assert data.loc['2024-01-03', 'close'] == 2.0, "Overlapping BBB record kept its old values"
+        assert data.loc['2024-01-01', 'close'] == 1.0, "Earlier BBB record was changed"
+        print(f"Overlapping BBB insert kept history and updated the shared record ({len(data)} records)")
+        return True
+        
+    except Exception as e:
+        print(f"Per-symbol insert test failed: {e}")
+        return False
+
 def test_data_collection():
     """Test data collection functionality"""
     print("\nTesting data collection...")
@@ -76,7 +117,7 @@ def test_data_collection():
         test_symbol = 'AAPL'
         print(f"Testing data collection for {test_symbol}...")
         
-        result = collector.collect_data_for_symbol(test_symbol)
+        result = asyncio.run(collector.collect_all_data([test_symbol]))[test_symbol]
         if result:
             print(f"Successfully collected data for {test_symbol}")
         else:
@@ -127,6 +168,9 @@ def main():
     # Test database operations
     db_test = test_database_operations()
     
+    # Test that upserts are scoped to the inserted symbol
+    insert_test = test_insert_keeps_other_symbols()
+    
     # Test data collection (only if API key is configured)
     collection_test = test_data_collection()
     
@@ -136,10 +180,11 @@ def main():
     print("\n" + "=" * 50)
     print("Test Summary:")
     print(f"   Database Operations: {'PASS' if db_test else 'FAIL'}")
+    print(f"   Per-Symbol Inserts: {'PASS' if insert_test else 'FAIL'}")
     print(f"   Data Collection: {'PASS' if collection_test else 'FAIL'}")
     print(f"   Dashboard Functions: {'PASS' if dashboard_test else 'FAIL'}")
     
-    if all([db_test, collection_test, dashboard_test]):
+    if all([db_test, insert_test, collection_test, dashboard_test]):
         print("\nAll tests passed! The dashboard should work correctly.")
     else:
         print("\nSome tests failed. Check the error messages above.")